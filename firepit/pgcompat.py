@@ -0,0 +1,56 @@
+"""PostgreSQL driver shim: psycopg (3) if available, else psycopg2"""
+
+from contextlib import nullcontext
+
+try:
+    import psycopg
+    from psycopg import errors  # noqa: F401
+    from psycopg.rows import dict_row, tuple_row
+    PSYCOPG_VERSION = 3
+except ImportError:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    from psycopg2 import errors  # noqa: F401
+    PSYCOPG_VERSION = 2
+
+
+def connect(connstring, autocommit=False):
+    """Connect to PostgreSQL; rows are returned as dicts"""
+    if PSYCOPG_VERSION == 3:
+        return psycopg.connect(connstring, row_factory=dict_row, autocommit=autocommit)
+    conn = psycopg2.connect(connstring, cursor_factory=psycopg2.extras.RealDictCursor)
+    conn.autocommit = autocommit
+    return conn
+
+
+def tuple_cursor(conn):
+    """Get a cursor that returns plain tuples instead of dicts"""
+    if PSYCOPG_VERSION == 3:
+        return conn.cursor(row_factory=tuple_row)
+    return conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+
+def execute_values(cursor, stmt, rows, page_size=100):
+    """Run `stmt`, which has a single "VALUES %s", for each page of `rows`"""
+    if PSYCOPG_VERSION == 2:
+        psycopg2.extras.execute_values(cursor, stmt, rows, page_size=page_size)
+        return
+    # psycopg 3 has no execute_values; since full pages reuse the same
+    # query text, psycopg will prepare them server-side automatically
+    rows = iter(rows)
+    while True:
+        page = [row for _, row in zip(range(page_size), rows)]
+        if not page:
+            break
+        row_tpl = '(' + ', '.join(['%s'] * len(page[0])) + ')'
+        values = ', '.join([row_tpl] * len(page))
+        cursor.execute(stmt.replace('VALUES %s', f'VALUES {values}', 1),
+                       [val for row in page for val in row])
+
+
+def pipeline(conn):
+    """Send statements without waiting on each one, if supported"""
+    if PSYCOPG_VERSION == 3 and psycopg.Pipeline.is_supported():
+        return conn.pipeline()
+    return nullcontext()
@@ -1,13 +1,16 @@
 import logging
 import os
 import re
-from functools import lru_cache
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import islice
 
 import orjson
-import psycopg2
-import psycopg2.extras
-import ujson
 
+from firepit import pgcompat
 from firepit.exceptions import DuplicateTable
 from firepit.exceptions import InvalidAttr
 from firepit.exceptions import UnknownViewname
@@ -35,77 +38,163 @@ def _infer_type(key, value):
     return rtype
 
 
+# Max parallel connections used to build deferred indexes
+INDEX_WORKERS = 4
+
+# Everything up to the first FROM of a view definition
+_FROM_RE = re.compile(r'^.*?FROM', re.DOTALL)
+
+# Rows per INSERT statement in upsert_multirow
+PAGE_SIZE = 1000
+
+# PostgreSQL's limit on parameters per statement
+MAX_PARAMS = 65535
+
+# Max server-side prepared INSERTs kept per session (like psycopg's prepared_max)
+PREPARED_MAX = 16
+
 # PostgreSQL defaults for COPY text format
 SEP = '\t'
-TEXT_ESCAPE_TABLE = str.maketrans({
-    '\\': '\\\\',
-    '\n': '\\n',
-    '\r': '\\r',
-    SEP: f'\\{SEP}'
-})
 
 
-@lru_cache(maxsize=256, typed=True)
 def _text_encode(value):
-    if value is None:
-        return r'\N'
-    elif not isinstance(value, str):
-        return str(value)
-    # MUST "escape" special chars
-    return value.translate(TEXT_ESCAPE_TABLE)
+    if not isinstance(value, str):
+        return r'\N' if value is None else str(value)
+    # Most values (URLs, ids, hashes) don't need escaping
+    if '\\' not in value and '\n' not in value and '\r' not in value and SEP not in value:
+        return value
+    # MUST "escape" special chars (backslash first!)
+    return (value.replace('\\', '\\\\')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+            .replace(SEP, f'\\{SEP}'))
 
 
-class ListToTextIO:
-    """
-    Convert an iterable of lists into a file-like object with
-    PostgreSQL TEXT formatting
-    """
+def _binary_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return orjson.dumps(value).decode('utf-8')
+    return str(value)
 
-    def __init__(self, objs, cols, sep=SEP):
-        self.it = iter(objs)
-        self.cols = cols
-        self.sep = sep
-        self.buf = ''
 
-    def read(self, n):
-        result = ''
-        try:
-            while n > len(self.buf):
-                obj = next(self.it)
-                vals = [ujson.dumps(val) if isinstance(val, list)
-                        else _text_encode(val) for val in obj]
-                self.buf += self.sep.join(vals) + '\n'
-            result = self.buf[:n]
-            self.buf = self.buf[n:]
-        except StopIteration:
-            result = self.buf
-            self.buf = ''
-        return result
+def _invalid_input(coltype, value):
+    # Same error PostgreSQL raises for bad input in TEXT COPY
+    return pgcompat.errors.InvalidTextRepresentation(
+        f'invalid input syntax for type {coltype}: "{value}"')
+
+
+def _binary_numeric(value):
+    # bool is an int, but TEXT COPY would reject "True"
+    if value is None or (isinstance(value, (int, Decimal)) and not isinstance(value, bool)):
+        return value
+    try:
+        return Decimal(str(value))
+    except ArithmeticError:
+        raise _invalid_input('numeric', value) from None
+
+
+def _binary_real(value):
+    if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return value
+    try:
+        return float(str(value))
+    except ValueError:
+        raise _invalid_input('real', value) from None
+
+
+# Spellings PostgreSQL accepts for boolean input
+_BOOL_TEXT = {
+    't': True, 'true': True, 'y': True, 'yes': True, 'on': True, '1': True,
+    'f': False, 'false': False, 'n': False, 'no': False, 'off': False, '0': False,
+}
+
+
+def _binary_boolean(value):
+    # psycopg would dump any truthy value (even "false") as TRUE
+    if value is None or isinstance(value, bool):
+        return value
+    try:
+        return _BOOL_TEXT[str(value).strip().lower()]
+    except KeyError:
+        raise _invalid_input('boolean', value) from None
+
+
+# Binary COPY is strict about wire types (unlike TEXT, where
+# PostgreSQL parses every value), so coerce values to the column type
+BINARY_CONVERTERS = {
+    'text': _binary_text,
+    'numeric': _binary_numeric,
+    'real': _binary_real,
+    'boolean': _binary_boolean,
+}
+
+
+def _copy_types(schema):
+    """Get PostgreSQL type names for COPY from a writer schema"""
+    # Schemas come from either infer_type (e.g. "TEXT UNIQUE") or
+    # information_schema (e.g. "text")
+    return [coltype.lower().replace(' unique', '') for coltype in schema.values()]
 
 
-class TuplesToTextIO:
+def _scalar_encode(value):
+    return r'\N' if value is None else str(value)
+
+
+def _list_or_text_encode(value):
+    if isinstance(value, list):
+        # JSON already escapes control chars, but COPY would eat its backslashes
+        return orjson.dumps(value).decode('utf-8').replace('\\', '\\\\')
+    return _text_encode(value)
+
+
+# Lists are stored in TEXT columns, so only columns of these types are
+# known to never hold a list (or need escaping)
+SCALAR_TYPES = frozenset(['numeric', 'real', 'boolean'])
+
+
+def _list_columns(schema):
+    """Get the indices of columns in `schema` that may hold lists"""
+    return tuple(i for i, coltype in enumerate(_copy_types(schema))
+                 if coltype not in SCALAR_TYPES)
+
+
+class ListToTextIO:
     """
-    Convert an iterable of tuples into a file-like object
+    Convert an iterable of lists into a file-like object with
+    PostgreSQL TEXT formatting
     """
 
-    def __init__(self, objs, cols, sep=SEP):
+    def __init__(self, objs, cols, sep=SEP, schema=None):
         self.it = iter(objs)
         self.cols = cols
         self.sep = sep
-        self.buf = ''
+        if schema:
+            self._encoders = [_scalar_encode if coltype in SCALAR_TYPES
+                              else _list_or_text_encode
+                              for coltype in _copy_types(schema)]
+        else:
+            self._encoders = [_list_or_text_encode] * len(cols)
+        self._lines = []
+        self._pending = ''
 
     def read(self, n):
-        result = ''
+        lines = self._lines
+        encoders = self._encoders
+        join = self.sep.join
+        size = len(self._pending)
         try:
-            while n > len(self.buf):
+            while n > size:
                 obj = next(self.it)
-                self.buf += self.sep.join(obj)
-                self.buf += '\n'
-            result = self.buf[:n]
-            self.buf = self.buf[n:]
+                line = join([enc(val) for enc, val in zip(encoders, obj)]) + '\n'
+                lines.append(line)
+                size += len(line)
         except StopIteration:
-            result = self.buf
-            self.buf = ''
+            pass
+        if lines:
+            self._pending += ''.join(lines)
+            lines.clear()
+        result, self._pending = self._pending[:n], self._pending[n:]
         return result
 
 
@@ -119,59 +208,59 @@ class PgStorage(SqlStorage):
         self.dbname = dbname
         self.infer_type = _infer_type
         self.defer_index = False
+        self._tmp_tables = {}  # (tablename, colnames) -> staging table name
+        self._cursor = None  # Reused for statements that don't return rows
+        self._prepared = OrderedDict()  # (INSERT statement, rows) -> (name, EXECUTE statement); LRU
         if not session_id:
             session_id = 'firepit'
         self.session_id = session_id
-        options = f'options=--search-path%3D{session_id}'
+        # Quoted (%22) so mixed-case names aren't folded to lower case
+        options = f'options=--search-path%3D%22{session_id}%22'
         sep = '&' if '?' in url else '?'
-        connstring = f'{url}{sep}{options}'
-        self.connection = psycopg2.connect(
-            connstring,
-            cursor_factory=psycopg2.extras.RealDictCursor)
-
-        if session_id:
+        self._connstring = f'{url}{sep}{options}'
+        self.connection = pgcompat.connect(self._connstring)
+
+        # One round trip to see if this session is already set up (the
+        # search_path is already set via `options` above)
+        stmt = ('SELECT to_regnamespace(%s) IS NOT NULL AS has_schema,'
+                ' to_regclass(%s) IS NOT NULL AS done')
+        cursor = self._query(stmt, (f'"{session_id}"', f'"{session_id}"."__queries"'),
+                             pgcompat.tuple_cursor(self.connection))
+        has_schema, done = cursor.fetchone()
+        cursor.close()
+        if not has_schema:
             try:
                 self._execute(f'CREATE SCHEMA IF NOT EXISTS "{session_id}";')
-            except psycopg2.errors.UniqueViolation:
-                self.connection.rollback()
-
-        self._execute(f'SET search_path TO "{session_id}";')
-
-        stmt = ("SELECT (EXISTS (SELECT *"
-                " FROM INFORMATION_SCHEMA.TABLES"
-                " WHERE TABLE_SCHEMA = %s"
-                " AND  TABLE_NAME = '__queries'))")
-        res = self._query(stmt, (session_id,)).fetchone()
-        done = list(res.values())[0] if res else False
+                self.connection.commit()
+            except pgcompat.errors.UniqueViolation:
+                self._rollback()
         if not done:
             self._setup()
 
         logger.debug("Connection to PostgreSQL DB %s successful", dbname)
 
     def _setup(self):
-        cursor = self._execute('BEGIN;')
-        try:
-            self._execute('''CREATE FUNCTION match(pattern TEXT, value TEXT)
+        # Static DDL with no parameters, so send it as one script
+        stmt = '''CREATE FUNCTION match(pattern TEXT, value TEXT)
                 RETURNS boolean AS $$
                     SELECT regexp_match(value, pattern) IS NOT NULL;
-            $$ LANGUAGE SQL;''', cursor=cursor)
-            self._execute('''CREATE FUNCTION in_subnet(addr TEXT, net TEXT)
+            $$ LANGUAGE SQL;
+            CREATE FUNCTION in_subnet(addr TEXT, net TEXT)
                 RETURNS boolean AS $$
                     SELECT addr::inet <<= net::inet;
-            $$ LANGUAGE SQL;''', cursor=cursor)
+            $$ LANGUAGE SQL;'''
 
-            # Do DB initization from base class
-            stmt = ('CREATE UNLOGGED TABLE IF NOT EXISTS "__symtable" '
-                    '(name TEXT, type TEXT, appdata TEXT);')
-            self._execute(stmt, cursor)
-            stmt = ('CREATE UNLOGGED TABLE IF NOT EXISTS "__queries" '
-                    '(sco_id TEXT, query_id TEXT);')
-            self._execute(stmt, cursor)
+        # Do DB initization from base class
+        stmt += ('CREATE UNLOGGED TABLE IF NOT EXISTS "__symtable" '
+                 '(name TEXT, type TEXT, appdata TEXT);'
+                 'CREATE UNLOGGED TABLE IF NOT EXISTS "__queries" '
+                 '(sco_id TEXT, query_id TEXT);')
+        try:
+            self._execute(stmt)
             self.connection.commit()
-            cursor.close()
-        except (psycopg2.errors.DuplicateFunction, psycopg2.errors.UniqueViolation):
+        except (pgcompat.errors.DuplicateFunction, pgcompat.errors.UniqueViolation):
             # We probably already created all these, so ignore this
-            self.connection.rollback()
+            self._rollback()
 
     def _get_writer(self, **kwargs):
         """Get a DB inserter object"""
@@ -190,6 +279,90 @@ class PgStorage(SqlStorage):
             logger.debug("Closing PostgreSQL DB connection")
             self.connection.close()
 
+    def _get_cursor(self):
+        """Get the reusable statement cursor (callers may have closed it)"""
+        if self._cursor is None or self._cursor.closed:
+            self._cursor = self.connection.cursor()
+        return self._cursor
+
+    def _execute(self, statement, cursor=None):
+        """Private wrapper for logging SQL statements"""
+        logger.debug('Executing statement: %s', statement)
+        if not cursor:
+            cursor = self._get_cursor()
+        cursor.execute(statement)
+        return cursor
+
+    def _rollback(self):
+        """Roll back the current transaction and anything cached from it"""
+        self.connection.rollback()
+        self._tmp_tables.clear()
+
+    def _undo(self, savepoint, cursor=None):
+        """
+        Undo a failed statement and get a cursor to carry on with.
+
+        Inside a transaction() block, only roll back to `savepoint`:
+        rolling back the whole transaction would silently discard the
+        rest of the block's work.
+        """
+        if self._in_tx:
+            self._execute(f'ROLLBACK TO SAVEPOINT {savepoint};', cursor)
+            return cursor
+        self._rollback()
+        return self._execute('BEGIN;')
+
+    def _schema_snapshot(self):
+        """Get column names for every table in this session's schema"""
+        # One pg_catalog query instead of information_schema per table
+        cursor = self._query("SELECT c.relname, a.attname"
+                             " FROM pg_class c"
+                             " JOIN pg_namespace n ON n.oid = c.relnamespace"
+                             " LEFT JOIN pg_attribute a ON a.attrelid = c.oid"
+                             "  AND a.attnum > 0 AND NOT a.attisdropped"
+                             " WHERE n.nspname = %s AND c.relkind IN ('r', 'p')"
+                             " ORDER BY c.relname, a.attnum", (self.session_id,),
+                             pgcompat.tuple_cursor(self.connection))
+        snapshot = {}
+        for relname, attname in cursor.fetchall():
+            cols = snapshot.setdefault(relname, [])
+            if attname:
+                cols.append(attname)
+        cursor.close()
+        return snapshot
+
+    def flush(self):
+        """Commit any pending work (e.g. from _create_table or _add_column)"""
+        self.connection.commit()
+
+    @contextmanager
+    def transaction(self, unsafe=False):
+        """
+        Run everything in the block as one transaction, committed at the
+        end (or rolled back on error) instead of after each statement.
+
+        A failed query inside the block is only undone by itself, so
+        callers can catch e.g. UnknownViewname and carry on.
+
+        With `unsafe`, also turn off synchronous_commit for it: a crash
+        may then lose the most recent commits (but won't corrupt the DB).
+        """
+        if self._in_tx:
+            # Already inside one; let the outermost block commit
+            yield self
+            return
+        self._in_tx = True
+        try:
+            if unsafe:
+                self._execute('SET LOCAL synchronous_commit = OFF;')
+            yield self
+            self.connection.commit()
+        except BaseException:
+            self._rollback()
+            raise
+        finally:
+            self._in_tx = False
+
     def _query(self, query, values=None, cursor=None):
         """Private wrapper for logging SQL query"""
         logger.debug('Executing query: %s', query)
@@ -197,15 +370,26 @@ class PgStorage(SqlStorage):
             cursor = self.connection.cursor()
         if not values:
             values = ()
+        if self._in_tx:
+            # So a failure doesn't abort the caller's transaction (see _undo)
+            self._execute('SAVEPOINT query;')
         try:
             cursor.execute(query, values)
-        except psycopg2.errors.UndefinedColumn as e:
-            self.connection.rollback()
+        except pgcompat.errors.UndefinedColumn as e:
+            self._undo('query')
             raise InvalidAttr(str(e)) from e
-        except psycopg2.errors.UndefinedTable as e:
-            self.connection.rollback()
+        except pgcompat.errors.UndefinedTable as e:
+            self._undo('query')
             raise UnknownViewname(str(e)) from e
-        self.connection.commit()
+        except pgcompat.errors.Error:
+            if self._in_tx:
+                self._undo('query')
+            raise
+        if self._in_tx:
+            # Not `cursor`, since that would discard its results
+            self._execute('RELEASE SAVEPOINT query;')
+        else:
+            self.connection.commit()
         return cursor
 
     def _create_table(self, tablename, columns):
@@ -213,28 +397,26 @@ class PgStorage(SqlStorage):
         stmt = f'CREATE UNLOGGED TABLE "{tablename}" ('
         stmt += ','.join([f'"{colname}" {coltype}' for colname, coltype in columns.items()])
         stmt += ');'
+        if not self.defer_index and 'x_contained_by_ref' in columns:
+            stmt += f'CREATE INDEX "{tablename}_obs" ON "{tablename}" ("x_contained_by_ref");'
         logger.debug('_create_table: "%s"', stmt)
+        # Don't commit here; this is usually followed by inserts that
+        # will.  The savepoint means a failure won't undo other pending
+        # work; release it on success so they don't pile up in one ingest.
+        cursor = self._get_cursor()
         try:
-            cursor = self._execute(stmt)
-            if not self.defer_index and 'x_contained_by_ref' in columns:
-                self._execute(f'CREATE INDEX "{tablename}_obs" ON "{tablename}" ("x_contained_by_ref");', cursor)
-            self.connection.commit()
-            cursor.close()
-        except (psycopg2.errors.DuplicateTable,
-                psycopg2.errors.DuplicateObject,
-                psycopg2.errors.UniqueViolation) as e:
-            self.connection.rollback()
+            self._execute(f'SAVEPOINT create_table;{stmt}RELEASE SAVEPOINT create_table;', cursor)
+        except (pgcompat.errors.DuplicateTable,
+                pgcompat.errors.DuplicateObject,
+                pgcompat.errors.UniqueViolation) as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT create_table;')
             raise DuplicateTable(tablename) from e
 
     def _add_column(self, tablename, prop_name, prop_type):
-        stmt = f'ALTER TABLE "{tablename}" ADD COLUMN "{prop_name}" {prop_type};'
+        stmt = f'ALTER TABLE "{tablename}" ADD COLUMN IF NOT EXISTS "{prop_name}" {prop_type};'
         logger.debug('new_property: "%s"', stmt)
-        try:
-            cursor = self._execute(stmt)
-            self.connection.commit()
-            cursor.close()
-        except psycopg2.errors.DuplicateColumn:
-            self.connection.rollback()
+        # Don't commit here; see _create_table
+        self._execute(stmt)
 
     def _create_empty_view(self, viewname, cursor):
         cursor.execute(f'CREATE VIEW "{viewname}" AS SELECT NULL as type WHERE 1<>1;')
@@ -244,6 +426,8 @@ class PgStorage(SqlStorage):
         validate_name(viewname)
         if not cursor:
             cursor = self._execute('BEGIN;')
+        if self._in_tx:
+            self._execute('SAVEPOINT create_view;', cursor)
         is_new = True
         if not deps:
             deps = []
@@ -256,23 +440,24 @@ class PgStorage(SqlStorage):
             else:
                 self._execute(f'ALTER TABLE "{viewname}" RENAME TO "_{viewname}"', cursor)
                 slct = slct.replace(viewname, f'_{viewname}')
-            # Swap out the viewname for its definition
-            select = re.sub(f'"{viewname}"', f'({slct}) AS tmp', select)
+            # Swap out the viewname for its definition (a literal
+            # replace; validate_name ensures no quotes in viewname)
+            select = select.replace(f'"{viewname}"', f'({slct}) AS tmp')
         try:
             self._execute(f'CREATE OR REPLACE VIEW "{viewname}" AS {select}', cursor)
-        except psycopg2.errors.UndefinedTable:
+        except pgcompat.errors.UndefinedTable:
             # Missing dep?
-            self.connection.rollback()
-            cursor = self._execute('BEGIN;')
+            cursor = self._undo('create_view', cursor)
             self._create_empty_view(viewname, cursor)
-        except psycopg2.errors.InvalidTableDefinition:
+        except pgcompat.errors.InvalidTableDefinition:
             # Usually "cannot drop columns from view"
             #logger.error(e, exc_info=e)
-            self.connection.rollback()
-            cursor = self._execute('BEGIN;')
+            cursor = self._undo('create_view', cursor)
             self._execute(f'DROP VIEW IF EXISTS "{viewname}";', cursor)
             self._execute(f'CREATE VIEW "{viewname}" AS {select}', cursor)
             is_new = False
+        if self._in_tx:
+            self._execute('RELEASE SAVEPOINT create_view;', cursor)
         if is_new:
             self._new_name(cursor, viewname, sco_type)
         return cursor
@@ -281,69 +466,95 @@ class PgStorage(SqlStorage):
         cursor = self._query("SELECT definition"
                              " FROM pg_views"
                              " WHERE schemaname = %s"
-                             " AND viewname = %s", (self.session_id, viewname))
+                             " AND viewname = %s", (self.session_id, viewname),
+                             pgcompat.tuple_cursor(self.connection))
         viewdef = cursor.fetchone()
+        cursor.close()
         if viewdef:
-            stmt = viewdef['definition'].rstrip(';')
+            stmt = viewdef[0].rstrip(';')
 
             # PostgreSQL will "expand" the original "*" to the columns
             # that existed at that time.  We need to get the star back, to
             # match SQLite3's behavior.
-            return re.sub(r'^.*?FROM', 'SELECT * FROM', stmt, 1, re.DOTALL)
+            return _FROM_RE.sub('SELECT * FROM', stmt, 1)
 
         # Must be a table
         return f'SELECT * FROM "{viewname}"'
 
     def _is_sql_view(self, name, cursor=None):
-        cursor = self._query("SELECT definition"
-                             " FROM pg_views"
-                             " WHERE schemaname = %s"
-                             " AND viewname = %s", (self.session_id, name))
-        viewdef = cursor.fetchone()
-        return viewdef is not None
+        cursor = self._query("SELECT relkind FROM pg_class"
+                             " WHERE oid = to_regclass(%s)",
+                             (f'"{self.session_id}"."{name}"',),
+                             pgcompat.tuple_cursor(self.connection))
+        res = cursor.fetchone()
+        cursor.close()
+        return res is not None and res[0] == 'v'
 
     def tables(self):
         cursor = self._query("SELECT table_name"
                              " FROM information_schema.tables"
                              " WHERE table_schema = %s"
-                             "   AND table_type != 'VIEW'", (self.session_id, ))
+                             "   AND table_type != 'VIEW'", (self.session_id, ),
+                             pgcompat.tuple_cursor(self.connection))
         rows = cursor.fetchall()
-        return [i['table_name'] for i in rows
-                if not i['table_name'].startswith('__')]
+        cursor.close()
+        return [row[0] for row in rows if not row[0].startswith('__')]
 
     def types(self):
         stmt = ("SELECT table_name FROM information_schema.tables"
                 " WHERE table_schema = %s AND table_type != 'VIEW'"
                 "  EXCEPT SELECT name as table_name FROM __symtable")
-        cursor = self._query(stmt, (self.session_id, ))
+        cursor = self._query(stmt, (self.session_id, ), pgcompat.tuple_cursor(self.connection))
         rows = cursor.fetchall()
+        cursor.close()
         # Ignore names that start with 1 or 2 underscores
-        return [i['table_name'] for i in rows
-                if not i['table_name'].startswith('_')]
+        return [row[0] for row in rows if not row[0].startswith('_')]
 
     def columns(self, viewname):
         validate_name(viewname)
         cursor = self._query("SELECT column_name"
                              " FROM information_schema.columns"
                              " WHERE table_schema = %s"
-                             " AND table_name = %s", (self.session_id, viewname))
+                             " AND table_name = %s", (self.session_id, viewname),
+                             pgcompat.tuple_cursor(self.connection))
         rows = cursor.fetchall()
-        return [i['column_name'] for i in rows]
+        cursor.close()
+        return [row[0] for row in rows]
 
     def schema(self, viewname):
         validate_name(viewname)
-        cursor = self._query("SELECT column_name AS name, data_type AS type"
+        cursor = self._query("SELECT column_name, data_type"
                              " FROM information_schema.columns"
                              " WHERE table_schema = %s"
-                             " AND table_name = %s", (self.session_id, viewname))
-        return cursor.fetchall()
+                             " AND table_name = %s", (self.session_id, viewname),
+                             pgcompat.tuple_cursor(self.connection))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [{'name': name, 'type': coltype} for name, coltype in rows]
 
     def delete(self):
         """Delete ALL data in this store"""
         cursor = self._execute('BEGIN;')
         self._execute(f'DROP SCHEMA "{self.session_id}" CASCADE;', cursor)
-        self.connection.commit()
-        cursor.close()
+        if self._prepared:
+            self._execute(';'.join([f'DEALLOCATE {name}' for name, _ in self._prepared.values()]), cursor)
+            self._prepared.clear()
+        self._commit()
+        self._tmp_tables.clear()
+
+    def cache(self, query_id, bundles, batchsize=2000, **kwargs):
+        """Overrides parent; commits once for all `bundles`
+
+        Also accepts `unsafe` (see `transaction`) to speed up large loads.
+        """
+        unsafe = kwargs.pop('unsafe', False)
+        with self.transaction(unsafe=unsafe):
+            super().cache(query_id, bundles, batchsize, **kwargs)
+
+    def update(self, objects, query_id=None):
+        """Overrides parent; commits once for all `objects`"""
+        with self.transaction():
+            super().update(objects, query_id)
 
     def upsert_many(self, cursor, tablename, objs, query_id, schema, **kwargs):
         use_copy = kwargs.get('use_copy')
@@ -357,8 +568,7 @@ class PgStorage(SqlStorage):
         quoted_colnames = [f'"{x}"' for x in colnames]
         valnames = ', '.join(quoted_colnames)
 
-        placeholders = ', '.join([f"({', '.join([self.placeholder] * len(colnames))})"] * len(objs))
-        stmt = f'INSERT INTO "{tablename}" ({valnames}) VALUES {placeholders}'
+        stmt = f'INSERT INTO "{tablename}" ({valnames}) VALUES %s'
         if 'id' in colnames:
             idx = colnames.index('id')
             if tablename == 'identity':
@@ -367,61 +577,195 @@ class PgStorage(SqlStorage):
                 excluded = self._get_excluded(colnames, tablename)
                 action = f'UPDATE SET {excluded}'
             stmt += f' ON CONFLICT (id) DO {action}'
-        values = []
-        query_values = []
-        for obj in objs:
-            if query_id:
-                query_values.append(obj[idx])
-                query_values.append(query_id)
-            values.extend([str(orjson.dumps(value), 'utf-8') if isinstance(value, list) else value for value in obj])
-        cursor.execute(stmt, values)
+        list_idx = _list_columns(schema)
+
+        def _rows():
+            # Avoid global/attribute lookups in the inner loop
+            dumps = orjson.dumps
+            decode = bytes.decode
+            _isinstance = isinstance
+            list_type = list
+            for obj in objs:
+                row = list_type(obj)
+                for i in list_idx:
+                    val = row[i]
+                    if _isinstance(val, list_type):
+                        row[i] = decode(dumps(val))
+                yield row
+
+        self._insert_values(cursor, stmt, _rows(), len(colnames))
 
         if query_id:
             # Now add to query table as well
-            placeholders = ', '.join([f'({self.placeholder}, {self.placeholder})'] * len(objs))
-            stmt = (f'INSERT INTO "__queries" (sco_id, query_id)'
-                    f' VALUES {placeholders}')
-            cursor.execute(stmt, query_values)
+            stmt = 'INSERT INTO "__queries" (sco_id, query_id) VALUES %s'
+            self._insert_values(cursor, stmt, ((obj[idx], query_id) for obj in objs), 2)
+
+    def _get_prepared(self, cursor, stmt, ncols, nrows):
+        """Get a server-side prepared version of `stmt` for `nrows` rows"""
+        key = (stmt, nrows)
+        if key in self._prepared:
+            self._prepared.move_to_end(key)
+        else:
+            if len(self._prepared) >= PREPARED_MAX:
+                # Schema changes mean new statements; drop the least recently used
+                name, _ = self._prepared.popitem(last=False)[1]
+                cursor.execute(f'DEALLOCATE {name}')
+            name = f'ins_{uuid.uuid4().hex}'
+            values = ', '.join(['(' + ', '.join([f'${row * ncols + col + 1}' for col in range(ncols)]) + ')'
+                                for row in range(nrows)])
+            # PREPARE isn't undone by ROLLBACK, so this stays valid
+            cursor.execute(f'PREPARE {name} AS ' + stmt.replace('VALUES %s', f'VALUES {values}', 1))
+            placeholders = ', '.join([self.placeholder] * (ncols * nrows))
+            self._prepared[key] = (name, f'EXECUTE {name} ({placeholders})')
+        return self._prepared[key][1]
+
+    def _insert_values(self, cursor, stmt, rows, ncols):
+        """Insert `rows` with `stmt`, which has a single "VALUES %s" """
+        page_size = min(PAGE_SIZE, MAX_PARAMS // ncols)
+        if pgcompat.PSYCOPG_VERSION == 3:
+            # psycopg prepares repeated queries itself (and EXECUTE
+            # can't take bound parameters)
+            pgcompat.execute_values(cursor, stmt, rows, page_size=page_size)
+            return
+        rows = iter(rows)
+        while True:
+            page = list(islice(rows, page_size))
+            if len(page) < page_size:
+                # Don't prepare a statement for odd-sized leftovers
+                if page:
+                    pgcompat.execute_values(cursor, stmt, page, page_size=page_size)
+                break
+            # Full pages all have the same shape, so skip re-parsing/planning
+            execute = self._get_prepared(cursor, stmt, ncols, page_size)
+            cursor.execute(execute, [val for row in page for val in row])
+
+    def _get_insert_from(self, tablename, colnames, valnames, source):
+        stmt = (f'INSERT INTO "{tablename}" ({valnames})'
+                f' SELECT {valnames} FROM {source}')
+        if 'id' in colnames:
+            if tablename == 'identity':
+                action = 'NOTHING'
+            else:
+                excluded = self._get_excluded(colnames, tablename)
+                action = f'UPDATE SET {excluded}'
+            stmt += f'  ON CONFLICT (id) DO {action}'
+        return stmt
+
+    def _get_tmp_table(self, cursor, tablename, colnames):
+        """Get a TEMP staging table for COPY into `tablename`, creating it if needed"""
+        key = (tablename, tuple(colnames))
+        tmp = self._tmp_tables.get(key)
+        if not tmp:
+            # Keep it for the session; rows are cleared on COMMIT
+            tmp = f'tmp_{uuid.uuid4().hex}'
+            cursor.execute(f'CREATE TEMP TABLE "{tmp}"'
+                           f' (LIKE "{tablename}" INCLUDING DEFAULTS)'
+                           ' ON COMMIT DELETE ROWS;')
+            self._tmp_tables[key] = tmp
+        return tmp
 
     def upsert_copy(self, cursor, tablename, objs, query_id, schema):
+        try:
+            if hasattr(cursor, 'copy'):
+                # psycopg 3: let the driver do the encoding
+                self._upsert_copy_v3(cursor, tablename, objs, query_id, schema)
+            else:
+                self._upsert_copy_v2(cursor, tablename, objs, query_id, schema)
+        except Exception:
+            # Staging tables created in this transaction won't survive it
+            self._tmp_tables.clear()
+            raise
+
+    def _upsert_copy_v2(self, cursor, tablename, objs, query_id, schema):
         colnames = list(schema.keys())
         quoted_colnames = [f'"{x}"' for x in colnames]
         valnames = ', '.join(quoted_colnames)
 
-        # Create a temp table that copies the structure of `tablename`
-        cursor.execute(f'CREATE TEMP TABLE tmp AS SELECT * FROM "{tablename}" WHERE 1=2;')
+        # Get a temp table that copies the structure of `tablename`
+        tmp = self._get_tmp_table(cursor, tablename, colnames)
 
         # Create a generator over `objs` that returns text formatted objects
-        copy_stmt = f"COPY tmp({valnames}) FROM STDIN WITH DELIMITER '{SEP}'"
-        cursor.copy_expert(copy_stmt, ListToTextIO(objs, colnames, sep=SEP))
+        copy_stmt = f"COPY \"{tmp}\" ({valnames}) FROM STDIN WITH DELIMITER '{SEP}'"
+        cursor.copy_expert(copy_stmt, ListToTextIO(objs, colnames, sep=SEP, schema=schema))
 
         # Now SELECT from TEMP table to real table
-        stmt = (f'INSERT INTO "{tablename}" ({valnames})'
-                f' SELECT {valnames} FROM tmp')
-        if 'id' in colnames:
-            if tablename == 'identity':
-                action = 'NOTHING'
-            else:
-                excluded = self._get_excluded(colnames, tablename)
-                action = f'UPDATE SET {excluded}'
-            stmt += f'  ON CONFLICT (id) DO {action}'
-        cursor.execute(stmt)
+        cursor.execute(self._get_insert_from(tablename, colnames, valnames, f'"{tmp}"'))
 
-        # Don't need the temp table anymore
-        cursor.execute('DROP TABLE tmp')
+        # Empty it for the next batch in case we're still in the same transaction
+        cursor.execute(f'TRUNCATE "{tmp}"')
 
         if query_id and 'id' in colnames:
             # Now add to query table as well
             idx = colnames.index('id')
             copy_stmt = f"COPY __queries(sco_id, query_id) FROM STDIN WITH DELIMITER '{SEP}'"
-            qobjs = [(obj[idx], query_id) for obj in objs]
-            cursor.copy_expert(copy_stmt, TuplesToTextIO(qobjs, ['sco_id', 'query_id'], sep=SEP))
+            qobjs = ((obj[idx], query_id) for obj in objs)
+            cursor.copy_expert(copy_stmt, ListToTextIO(qobjs, ['sco_id', 'query_id'], sep=SEP))
+
+    def _upsert_copy_v3(self, cursor, tablename, objs, query_id, schema):
+        colnames = list(schema.keys())
+        quoted_colnames = [f'"{x}"' for x in colnames]
+        valnames = ', '.join(quoted_colnames)
+        types = _copy_types(schema)
+        converters = [BINARY_CONVERTERS.get(coltype) for coltype in types]
+
+        # Get a temp table that copies the structure of `tablename`
+        tmp = self._get_tmp_table(cursor, tablename, colnames)
+
+        # Stream `objs` in binary format; psycopg handles NULLs and escaping
+        copy_stmt = f'COPY "{tmp}" ({valnames}) FROM STDIN WITH (FORMAT BINARY)'
+        with cursor.copy(copy_stmt) as copy:
+            copy.set_types(types)
+            for obj in objs:
+                copy.write_row([conv(val) if conv else val
+                                for conv, val in zip(converters, obj)])
+
+        # COPY can't be pipelined, but what follows it can
+        with pgcompat.pipeline(cursor.connection):
+            # Now SELECT from TEMP table to real table
+            cursor.execute(self._get_insert_from(tablename, colnames, valnames, f'"{tmp}"'))
+
+            # Empty it for the next batch in case we're still in the same transaction
+            cursor.execute(f'TRUNCATE "{tmp}"')
+
+        if query_id and 'id' in colnames:
+            # Now add to query table as well
+            idx = colnames.index('id')
+            copy_stmt = 'COPY __queries(sco_id, query_id) FROM STDIN WITH (FORMAT BINARY)'
+            with cursor.copy(copy_stmt) as copy:
+                copy.set_types(['text', 'text'])
+                for obj in objs:
+                    copy.write_row((obj[idx], query_id))
+
+    def _create_index(self, tablename, cursor=None):
+        stmt = f'CREATE INDEX IF NOT EXISTS "{tablename}_obs" ON "{tablename}" ("x_contained_by_ref");'
+        if cursor:
+            self._execute(stmt, cursor)
+            return
+        # Use a new autocommit connection so tables are indexed in parallel
+        conn = pgcompat.connect(self._connstring, autocommit=True)
+        try:
+            self._execute(stmt, conn.cursor()).close()
+        finally:
+            conn.close()
 
     def finish(self):
+        if not self._in_tx:
+            self.flush()
         if self.defer_index:
-            cursor = self._execute('BEGIN;')
-            for tablename in self.tables():
-                if 'x_contained_by_ref' in self.columns(tablename):
-                    self._execute(f'CREATE INDEX "{tablename}_obs" ON "{tablename}" ("x_contained_by_ref");', cursor)
-            self.connection.commit()
-            cursor.close()
+            # Get every table's columns at once, not a query per table
+            snapshot = self._schema_snapshot()
+            tablenames = [name for name, cols in snapshot.items()
+                          if not name.startswith('__') and 'x_contained_by_ref' in cols]
+            if self._in_tx:
+                # Other connections can't see tables from the caller's
+                # open transaction, so index them here
+                cursor = self._get_cursor()
+                for tablename in tablenames:
+                    self._create_index(tablename, cursor)
+            else:
+                # Different tables don't conflict, so index them in parallel
+                with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as executor:
+                    futures = [executor.submit(self._create_index, name)
+                               for name in tablenames]
+                    for future in futures:
+                        future.result()
@@ -113,16 +113,20 @@ class SqlWriter:
 
     def write_records(self, obj_type, records, schema, replace, query_id):
         tablename = f'{self.prefix}{obj_type}'
+        # Leave it to the store if it already has a transaction open
+        own_tx = not self.store._in_tx
         try:
             cursor = self.store.connection.cursor()
-            cursor.execute('BEGIN')
+            if own_tx:
+                cursor.execute('BEGIN')
             if replace:
                 for obj in records:
                     self._replace(cursor, tablename, obj, schema)
             else:
                 kwargs = {k: v for k, v in self.kwargs.items() if k is not 'query_id'}
                 self.store.upsert_many(cursor, tablename, records, query_id, schema, **kwargs)
-            cursor.execute('COMMIT')
+            if own_tx:
+                cursor.execute('COMMIT')
         finally:
             cursor.close()
 
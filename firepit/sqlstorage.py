@@ -74,6 +74,10 @@ class SqlStorage:
         # Python-to-SQL type mapper
         self.infer_type = infer_type
 
+        # Set while a caller-owned transaction is open (see
+        # PgStorage.transaction); writers must not commit then
+        self._in_tx = False
+
     def _get_writer(self, **kwargs):
         """Get a DB inserter object"""
         # This is DB-specific
@@ -87,7 +91,7 @@ class SqlStorage:
         stmt = ('CREATE TABLE IF NOT EXISTS "__queries" '
                 '(sco_id TEXT, query_id TEXT);')
         self._execute(stmt, cursor)
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def _new_name(self, cursor, name, sco_type):
@@ -99,6 +103,11 @@ class SqlStorage:
         stmt = f'DELETE FROM {self.db_schema_prefix}"__symtable" WHERE name = {self.placeholder};'
         cursor.execute(stmt, (name,))
 
+    def _commit(self):
+        """Commit, unless inside a caller-owned transaction (which will)"""
+        if not self._in_tx:
+            self.connection.commit()
+
     def _execute(self, statement, cursor=None):
         """Private wrapper for logging SQL statements"""
         logger.debug('Executing statement: %s', statement)
@@ -113,7 +122,7 @@ class SqlStorage:
         if not cursor:
             cursor = self.connection.cursor()
         cursor.execute(cmd)
-        self.connection.commit()
+        self._commit()
 
     def _query(self, query, values=None, cursor=None):
         """Private wrapper for logging SQL query"""
@@ -123,7 +132,7 @@ class SqlStorage:
         if not values:
             values = ()
         cursor.execute(query, values)
-        self.connection.commit()
+        self._commit()
         return cursor
 
     def _select(self, tvname, cols="*", sortby=None, groupby=None,
@@ -178,7 +187,7 @@ class SqlStorage:
         cursor = self._execute(stmt)
         if 'x_contained_by_ref' in columns:
             self._execute(f'CREATE INDEX "{tablename}_obs" ON "{tablename}" ("x_contained_by_ref");', cursor)
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def _add_column(self, tablename, prop_name, prop_type):
@@ -223,7 +232,7 @@ class SqlStorage:
                   f'  WHERE {where});')
 
         cursor = self._create_view(viewname, select, sco_type, deps=[tablename], cursor=cursor)
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def _get_excluded(self, colnames, tablename):
@@ -316,7 +325,7 @@ class SqlStorage:
             stmt = self._select(on, groupby=by)
         sco_type = self.table_type(on)
         cursor = self._create_view(viewname, stmt, sco_type, deps=[on])
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def load(self, viewname, objects, sco_type=None, query_id=None, preserve_ids=True):
@@ -394,7 +403,7 @@ class SqlStorage:
             # Recreate view
             self._execute(f'CREATE VIEW {self.db_schema_prefix}"{viewname}" AS {viewdef}', cursor)
 
-        self.connection.commit()
+        self._commit()
 
     def update(self, objects, query_id=None):
         """Update `objects`"""
@@ -434,7 +443,7 @@ class SqlStorage:
                 f' ON {l_var}."{l_on}" = {r_var}."{r_on}"')
         sco_type = self.table_type(l_var)
         cursor = self._create_view(viewname, stmt, sco_type, deps=[l_var, r_var])
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def extract(self, viewname, sco_type, query_id, pattern):
@@ -468,7 +477,7 @@ class SqlStorage:
         if where:
             slct += f' WHERE {where}'
         cursor = self._create_view(viewname, slct, sco_type, deps=[input_view])
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def lookup(self, viewname, cols="*", limit=None, offset=None):
@@ -599,7 +608,7 @@ class SqlStorage:
         stmt = ' UNION '.join(selects)
         sco_type = self.table_type(input_views[0])
         cursor = self._create_view(viewname, stmt, sco_type, deps=input_views)
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def remove_view(self, viewname):
@@ -608,7 +617,7 @@ class SqlStorage:
         cursor = self._execute('BEGIN;')
         self._execute(f'DROP VIEW IF EXISTS {self.db_schema_prefix}"{viewname}";', cursor)
         self._drop_name(cursor, viewname)
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def rename_view(self, oldname, newname):
@@ -632,7 +641,7 @@ class SqlStorage:
         self._drop_name(cursor, oldname)
         self._new_name(cursor, newname, view_type)
 
-        self.connection.commit()
+        self._commit()
         cursor.close()
 
     def finish(self):
@@ -14,7 +14,7 @@ requirements = [
     'ijson',
     'lark-parser',
     'orjson>=3.3.1',
-    'psycopg2-binary',
+    'psycopg[binary]>=3.1',
     'tabulate',
     'typer',
     'ujson'
@@ -27,14 +27,13 @@ test_requirements = ['pytest>=3', ]
 setup(
     author="IBM Security",
     author_email='pcoccoli@us.ibm.com',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
@@ -0,0 +1,173 @@
+import os
+import re
+from decimal import Decimal
+
+import orjson
+import pytest
+
+from firepit import pgcompat
+from firepit.exceptions import InvalidAttr
+from firepit.exceptions import UnknownViewname
+from firepit.pgstorage import BINARY_CONVERTERS
+from firepit.pgstorage import ListToTextIO
+from firepit.pgstorage import _copy_types
+
+from .helpers import tmp_storage
+
+
+@pytest.fixture
+def pg_storage(tmpdir):
+    if not os.getenv('FIREPITDB', '').startswith('postgresql'):
+        pytest.skip('requires PostgreSQL (set FIREPITDB)')
+    store = tmp_storage(tmpdir)
+    yield store
+    store.delete()
+
+
+def test_copy_types():
+    schema = {'id': 'TEXT UNIQUE', 'n': 'NUMERIC', 'r': 'real', 'b': 'BOOLEAN', 'refs': 'text'}
+    assert _copy_types(schema) == ['text', 'numeric', 'real', 'boolean', 'text']
+
+
+@pytest.mark.parametrize(
+    'coltype, value, expected', [
+        ('text', None, None),
+        ('text', 'foo', 'foo'),
+        ('text', 5, '5'),
+        ('text', ['a', 'b'], '["a","b"]'),
+        ('numeric', None, None),
+        ('numeric', 5, 5),
+        ('numeric', Decimal('2.5'), Decimal('2.5')),
+        ('numeric', 2.5, Decimal('2.5')),
+        ('numeric', '7', Decimal('7')),
+        ('real', None, None),
+        ('real', 3, 3),
+        ('real', 2.5, 2.5),
+        ('real', '2.5', 2.5),
+        ('boolean', None, None),
+        ('boolean', True, True),
+        ('boolean', False, False),
+        ('boolean', 'false', False),
+        ('boolean', 'f', False),
+        ('boolean', '0', False),
+        ('boolean', 0, False),
+        ('boolean', 'TRUE', True),
+        ('boolean', ' yes ', True),
+        ('boolean', 1, True),
+    ]
+)
+def test_binary_converters(coltype, value, expected):
+    result = BINARY_CONVERTERS[coltype](value)
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+@pytest.mark.parametrize(
+    'coltype, value', [
+        ('numeric', True),
+        ('numeric', 'foo'),
+        ('real', False),
+        ('boolean', 'maybe'),
+        ('boolean', 2),
+    ]
+)
+def test_binary_converters_invalid(coltype, value):
+    # Same error as TEXT COPY (i.e. psycopg2) would raise
+    with pytest.raises(pgcompat.errors.InvalidTextRepresentation):
+        BINARY_CONVERTERS[coltype](value)
+
+
+@pytest.mark.parametrize(
+    'row', [
+        ['thing--1', 'maybe', 1, 1.0],
+        ['thing--1', True, 'foo', 1.0],
+        ['thing--1', True, 1, 'foo'],
+    ]
+)
+def test_upsert_copy_invalid(pg_storage, row):
+    schema = {'id': 'TEXT UNIQUE', 'b': 'BOOLEAN', 'n': 'NUMERIC', 'r': 'REAL'}
+    pg_storage._create_table('thing', schema)
+    pg_storage.flush()
+    cursor = pg_storage.connection.cursor()
+    with pytest.raises(pgcompat.errors.InvalidTextRepresentation):
+        pg_storage.upsert_copy(cursor, 'thing', [row], None, schema)
+    pg_storage._rollback()
+
+
+def test_list_to_text_escaping():
+    objs = [
+        ['plain', 'a\tb', 'c\nd\re', 'back\\slash', None, 5],
+    ]
+    io = ListToTextIO(objs, ['a', 'b', 'c', 'd', 'e', 'f'])
+    # COPY takes a backslash followed by the delimiter as the literal delimiter
+    assert io.read(8192) == 'plain\ta\\\tb\tc\\nd\\re\tback\\\\slash\t\\N\t5\n'
+    assert io.read(8192) == ''
+
+
+def _copy_unescape(field):
+    # What PostgreSQL's COPY TEXT format does to each field
+    escapes = {'n': '\n', 'r': '\r', 't': '\t'}
+    return re.sub(r'\\(.)', lambda m: escapes.get(m.group(1), m.group(1)), field)
+
+
+def test_list_to_text_json_backslashes():
+    value = ['a\\b', 't\tz', 'q"x']
+    line = ListToTextIO([[value]], ['c']).read(8192)
+    assert line.endswith('\n')
+    assert orjson.loads(_copy_unescape(line[:-1])) == value
+
+
+def test_list_to_text_scalar_columns():
+    schema = {'id': 'TEXT UNIQUE', 'n': 'NUMERIC', 'b': 'BOOLEAN'}
+    io = ListToTextIO([['x', 5, True], ['y', None, None]], list(schema), schema=schema)
+    assert io.read(8192) == 'x\t5\tTrue\ny\t\\N\t\\N\n'
+
+
+def test_list_to_text_chunking():
+    objs = [[f'value-{i}', i] for i in range(100)]
+    expected = ''.join(f'value-{i}\t{i}\n' for i in range(100))
+    io = ListToTextIO(objs, ['a', 'b'])
+    chunks = []
+    while True:
+        chunk = io.read(7)
+        if not chunk:
+            break
+        assert len(chunk) <= 7
+        chunks.append(chunk)
+    assert ''.join(chunks) == expected
+
+
+def test_prepared_lru(pg_storage, monkeypatch):
+    monkeypatch.setattr('firepit.pgstorage.PREPARED_MAX', 2)
+    cursor = pg_storage.connection.cursor()
+    stmts = [f'INSERT INTO "__queries" (sco_id, query_id) VALUES %s -- {i}' for i in range(3)]
+    pg_storage._get_prepared(cursor, stmts[0], 2, 10)
+    pg_storage._get_prepared(cursor, stmts[1], 2, 10)
+    pg_storage._get_prepared(cursor, stmts[0], 2, 10)  # Now most recently used
+    pg_storage._get_prepared(cursor, stmts[2], 2, 10)  # Evicts stmts[1]
+    assert [key[0] for key in pg_storage._prepared] == [stmts[0], stmts[2]]
+    cursor.execute('SELECT name FROM pg_prepared_statements')
+    names = {row['name'] for row in cursor.fetchall()}
+    assert names == {name for name, _ in pg_storage._prepared.values()}
+
+
+def test_transaction_query_error(pg_storage, fake_bundle_file, fake_bundle_file_2):
+    with pg_storage.transaction():
+        pg_storage.cache('q1', fake_bundle_file)
+        with pytest.raises(UnknownViewname):
+            pg_storage.lookup('no_such_view')
+        with pytest.raises(InvalidAttr):
+            pg_storage.values('url:no_such_prop', 'url')
+        pg_storage.cache('q2', fake_bundle_file_2)
+    cursor = pg_storage._query('SELECT DISTINCT query_id FROM __queries ORDER BY query_id')
+    assert [row['query_id'] for row in cursor.fetchall()] == ['q1', 'q2']
+
+
+def test_transaction_rollback(pg_storage, fake_bundle_file):
+    with pytest.raises(RuntimeError):
+        with pg_storage.transaction():
+            pg_storage.cache('q1', fake_bundle_file)
+            pg_storage.extract('urls', 'url', 'q1', "[url:value LIKE '%page/1%']")
+            raise RuntimeError('abort')
+    assert pg_storage.tables() == []
+    assert pg_storage.views() == []
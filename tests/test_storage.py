@@ -582,3 +582,14 @@ def test_finish(fake_bundle_file, tmpdir):
     assert 'http://www8.example.com/page/176' in urls
     assert 'http://www27.example.com/page/64' not in urls
     store.delete()
+
+
+def test_cache_use_copy(fake_bundle_file, tmpdir):
+    store = tmp_storage(tmpdir)
+    store.cache('q1', fake_bundle_file, use_copy=True)  # Ignored by sqlite3
+    store.extract('urls', 'url', 'q1', "[url:value LIKE '%page/1%']")
+    urls = store.values('url:value', 'urls')
+    assert len(urls) == 14
+    assert 'http://www8.example.com/page/176' in urls
+    assert 'http://www27.example.com/page/64' not in urls
+    store.delete()